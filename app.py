@@ -1,10 +1,14 @@
 from fastapi import FastAPI, UploadFile, File, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import ORJSONResponse
+from fastapi.responses import ORJSONResponse, Response
 import os
 import time
 import hashlib
 import secrets
+import ssl
+from collections import OrderedDict
+from functools import lru_cache
 
 # ===============================
 # VoiceSafe AI — Enterprise Stable MVP
@@ -12,6 +16,8 @@ import secrets
 # - safe CORS (no "*" with credentials)
 # - file validation + size guard
 # - request-id + timing
+# - LRU response cache (same file -> cached JSON body)
+# - handlers return ORJSONResponse directly (no jsonable_encoder pass)
 # ===============================
 
 APP_NAME = "VoiceSafe AI"
@@ -28,6 +34,16 @@ MAX_BYTES = MAX_UPLOAD_MB * 1024 * 1024
 
 ALLOWED_PREFIXES = ("audio/", "video/")
 ALLOWED_EXT = (".mp3", ".wav", ".m4a", ".aac", ".ogg", ".flac", ".mp4", ".mov", ".webm")
+_EXT_SET = frozenset(e.lstrip(".") for e in ALLOWED_EXT)
+
+# responses are pure in the file hash, keep the most recent ones
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "4096"))
+
+# uploads are copied out of the spooled temp file this many bytes at a time
+UPLOAD_CHUNK = 1024 * 1024 # 1 MiB
+
+# sha256 goes through OpenSSL; log the build so SHA-NI support can be checked
+print(f"[app] {APP_NAME} {APP_VERSION} hashing via {ssl.OPENSSL_VERSION}")
 
 app = FastAPI(
     title=APP_NAME,
@@ -61,7 +77,40 @@ def clamp01(x: float) -> float:
 def clamp100(n: int) -> int:
     return 0 if n < 0 else 100 if n > 100 else n
 
-def deterministic_scores(file_hash_hex: str) -> dict:
+def read_upload(file: UploadFile) -> memoryview:
+    """
+    Copy the spooled upload into one preallocated buffer, 1 MiB at a time.
+    - size is known up front, so 413 is raised before allocating anything
+    - readinto() fills the buffer in place (no intermediate bytes objects)
+    """
+    f = file.file
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(0)
+
+    if size > MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"File too large. Max {MAX_UPLOAD_MB} MB")
+
+    buf = bytearray(size)
+    mv = memoryview(buf)
+    n = 0
+    while n < size:
+        got = f.readinto(mv[n:n + UPLOAD_CHUNK])
+        if not got:
+            break
+        n += got
+    return mv[:n]
+
+def hash_upload(file: UploadFile) -> tuple[int, bytes]:
+    """
+    Read + sha256 the upload. Blocking (temp file I/O, hashing up to
+    MAX_BYTES), so the handler runs it in the threadpool.
+    One-shot over the contiguous buffer so OpenSSL can use SHA-NI.
+    """
+    data = read_upload(file)
+    return len(data), hashlib.sha256(data).digest()
+
+def deterministic_scores(digest: bytes) -> dict:
     """
     Deterministic pseudo-scores from hash.
     This keeps MVP stable and demo-friendly for enterprise/investors:
@@ -69,10 +118,9 @@ def deterministic_scores(file_hash_hex: str) -> dict:
     - different file => different output
     """
     # use first bytes of hash to derive 3 numbers
-    b = bytes.fromhex(file_hash_hex[:32]) # 16 bytes
-    a = int.from_bytes(b[0:4], "big", signed=False)
-    c = int.from_bytes(b[4:8], "big", signed=False)
-    d = int.from_bytes(b[8:12], "big", signed=False)
+    a = int.from_bytes(digest[0:4], "big", signed=False)
+    c = int.from_bytes(digest[4:8], "big", signed=False)
+    d = int.from_bytes(digest[8:12], "big", signed=False)
 
     # map to 0..100 with slight shaping
     scam = (a % 101)
@@ -88,7 +136,8 @@ def deterministic_scores(file_hash_hex: str) -> dict:
 
     return {"scam_score": scam, "ai_probability": ai_prob, "stress_level": stress}
 
-def flags_from_scores(scam: int, ai_prob: int, stress: int) -> list[str]:
+@lru_cache(maxsize=4096)
+def flags_from_scores(scam: int, ai_prob: int, stress: int) -> tuple[str, ...]:
     flags = []
     if ai_prob >= 70:
         flags.append("AI voice synthesis indicators (prototype)")
@@ -100,8 +149,9 @@ def flags_from_scores(scam: int, ai_prob: int, stress: int) -> list[str]:
         flags.append("Urgency / pressure language markers (prototype)")
     if not flags:
         flags.append("No strong red flags detected (prototype)")
-    return flags[:6]
+    return tuple(flags[:6])
 
+@lru_cache(maxsize=4096)
 def summary_from_scores(scam: int, ai_prob: int, stress: int) -> str:
     if scam >= 80 or ai_prob >= 85:
         return "High risk signal. Verify identity via an official number before any payment or account action."
@@ -109,6 +159,23 @@ def summary_from_scores(scam: int, ai_prob: int, stress: int) -> str:
         return "Elevated risk signal. Pause and confirm identity using trusted official channels."
     return "Lower risk signal. Still verify via official channels if money or account access is involved."
 
+# ---------------------------
+# Response cache (file hash -> serialized JSON body)
+# - only touched from the event loop, so no lock needed
+# ---------------------------
+_response_cache: "OrderedDict[bytes, bytes]" = OrderedDict()
+
+def cache_get(file_hash: bytes) -> bytes | None:
+    out = _response_cache.get(file_hash)
+    if out is not None:
+        _response_cache.move_to_end(file_hash)
+    return out
+
+def cache_put(file_hash: bytes, body: bytes) -> None:
+    _response_cache[file_hash] = body
+    if len(_response_cache) > RESPONSE_CACHE_SIZE:
+        _response_cache.popitem(last=False)
+
 # ---------------------------
 # Middleware: request-id + timer
 # ---------------------------
@@ -128,14 +195,14 @@ async def add_request_id(request: Request, call_next):
 # ---------------------------
 @app.get("/health")
 async def health():
-    return {
+    return ORJSONResponse({
         "ok": True,
         "service": "voicesafe-ai",
         "version": APP_VERSION,
         "max_upload_mb": MAX_UPLOAD_MB,
         "cors_origins": ALLOW_ORIGINS,
         "model": "voicesafe-mvp-deterministic",
-    }
+    })
 
 # ---------------------------
 # ANALYZE
@@ -149,19 +216,19 @@ async def analyze(file: UploadFile = File(...)):
     if not ctype.startswith(ALLOWED_PREFIXES):
         raise HTTPException(status_code=400, detail=f"Unsupported content-type: {ctype or 'unknown'}")
 
-    if not any(name.endswith(ext) for ext in ALLOWED_EXT):
+    _, dot, ext = name.rpartition(".")
+    if not dot or ext not in _EXT_SET:
         # allow if content-type is audio/video even if extension odd, but be strict for enterprise
         raise HTTPException(status_code=400, detail=f"Unsupported file extension: {name}")
 
-    data = await file.read()
-    if not data:
+    # Deterministic hash, off the event loop (hashlib releases the GIL)
+    size, file_hash = await run_in_threadpool(hash_upload, file)
+    if not size:
         raise HTTPException(status_code=400, detail="Empty file")
 
-    if len(data) > MAX_BYTES:
-        raise HTTPException(status_code=413, detail=f"File too large. Max {MAX_UPLOAD_MB} MB")
-
-    # Deterministic hash
-    file_hash = hashlib.sha256(data).hexdigest()
+    cached = cache_get(file_hash)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
 
     # Get deterministic scores
     scores = deterministic_scores(file_hash)
@@ -182,8 +249,10 @@ async def analyze(file: UploadFile = File(...)):
         "stress_level": stress,
         "flags": flags_from_scores(scam, ai_prob, stress),
         "voice_match": "Unknown",
-        "file_hash": file_hash[:16], # short hash for debugging (not sensitive)
+        "file_hash": file_hash[:8].hex(), # short hash for debugging (not sensitive)
         "prototype": True,
         "disclaimer": "Advisory risk signals, not forensic identity verification.",
     }
-    return out
+    resp = ORJSONResponse(out)
+    cache_put(file_hash, resp.body)
+    return resp
@@ -33,6 +33,10 @@ CREATE TABLE IF NOT EXISTS analyses (
 """
 
 
+def db_enabled() -> bool:
+    return engine is not None
+
+
 def db_init() -> None:
     if not engine:
         return
@@ -40,19 +44,26 @@ def db_init() -> None:
         conn.execute(text(DDL))
 
 
+INSERT_SQL = """
+    INSERT INTO analyses
+    (id, ip, filename, bytes, scam_score, ai_voice_prob, stress_level, summary, flags, meta)
+    VALUES
+    (:id, :ip, :filename, :bytes, :scam_score, :ai_voice_prob, :stress_level, :summary, CAST(:flags AS jsonb), CAST(:meta AS jsonb))
+"""
+
+
 def insert_analysis(row: Dict[str, Any]) -> None:
-    if not engine:
+    insert_analyses([row])
+
+
+def insert_analyses(rows: List[Dict[str, Any]]) -> None:
+    """
+    Multi-row insert: one executemany in one transaction.
+    """
+    if not engine or not rows:
         return
     with engine.begin() as conn:
-        conn.execute(
-            text("""
-                INSERT INTO analyses
-                (id, ip, filename, bytes, scam_score, ai_voice_prob, stress_level, summary, flags, meta)
-                VALUES
-                (:id, :ip, :filename, :bytes, :scam_score, :ai_voice_prob, :stress_level, :summary, :flags::jsonb, :meta::jsonb)
-            """),
-            row,
-        )
+        conn.execute(text(INSERT_SQL), rows)
 
 
 def list_cases(limit: int = 50) -> List[Dict[str, Any]]:
@@ -0,0 +1,69 @@
+# file: AI/db_writer.py
+import os
+import time
+from typing import Any, Dict, List
+
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from db import db_enabled, db_init, insert_analysis, insert_analyses
+from job_queue import pop_db_writes, requeue_db_writes
+
+
+APP_NAME = "voicesafe-ai-db-writer"
+
+BATCH_SIZE = int(os.environ.get("DB_WRITER_BATCH", "100"))
+POLL_TIMEOUT_S = int(os.environ.get("DB_WRITER_BLPOP_TIMEOUT_S", "30"))
+RETRY_BACKOFF_S = int(os.environ.get("DB_WRITER_RETRY_BACKOFF_S", "5"))
+
+# Postgres unreachable (not a bad row): keep the rows and retry later
+_DB_DOWN = (OperationalError, InterfaceError)
+
+
+def _write_batch(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Insert a batch; returns the rows left unwritten because the DB is down.
+    - one executemany for the whole batch
+    - on a row error (e.g. duplicate id) retry singly, so only that row is lost
+    """
+    try:
+        insert_analyses(rows)
+        return []
+    except _DB_DOWN as e:
+        print(f"[db_writer] database unavailable: {str(e)[:200]}")
+        return rows
+    except Exception as e:
+        print(f"[db_writer] batch of {len(rows)} rows failed, retrying singly: {str(e)[:200]}")
+
+    for i, row in enumerate(rows):
+        try:
+            insert_analysis(row)
+        except _DB_DOWN as e:
+            print(f"[db_writer] database unavailable: {str(e)[:200]}")
+            return rows[i:]
+        except Exception as e:
+            print(f"[db_writer] insert {row.get('id')} failed: {str(e)[:200]}")
+    return []
+
+
+def main():
+    if not db_enabled():
+        print(f"[db_writer] DATABASE_URL not set; {APP_NAME} has nothing to write")
+        return
+
+    db_init()
+
+    print(f"[db_writer] started {APP_NAME} batch={BATCH_SIZE}")
+
+    while True:
+        rows = pop_db_writes(count=BATCH_SIZE, timeout_s=POLL_TIMEOUT_S)
+        if not rows:
+            continue
+
+        pending = _write_batch(rows)
+        if pending:
+            requeue_db_writes(pending)
+            time.sleep(RETRY_BACKOFF_S)
+
+
+if __name__ == "__main__":
+    main()
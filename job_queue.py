@@ -1,10 +1,14 @@
 # AI/job_queue.py
 import os
-import json
 import time
-import uuid
+import threading
+from collections import deque
 from typing import Any, Dict, Optional, Tuple
 
+import orjson
+
+from redis_pool import REDIS_URL, get_blocking_client, get_client
+
 # ============================================================
 # VoiceSafe AI - Job Queue
 # - Works with Redis if REDIS_URL is set
@@ -12,17 +16,20 @@ from typing import Any, Dict, Optional, Tuple
 # ============================================================
 
 APP_PREFIX = os.getenv("APP_PREFIX", "voicesafe")
-REDIS_URL = (os.getenv("REDIS_URL", "") or "").strip()
 
 # Rate limit defaults (can be overridden from env)
 RL_WINDOW_S = int(os.getenv("RL_WINDOW_S", "60"))
 RL_MAX_REQ = int(os.getenv("RL_MAX_REQ", "30"))
 
+# Analysis results cached by content hash
+RESULT_TTL_S = int(os.getenv("RESULT_TTL_S", "3600"))
+
 # Redis keys
 JOBS_KEY = f"{APP_PREFIX}:jobs" # hash: job_id -> json
 AUDIO_KEY = f"{APP_PREFIX}:audio" # hash: job_id -> json (path/meta)
 QUEUE_KEY = f"{APP_PREFIX}:queue" # list: job_id
 DONE_KEY = f"{APP_PREFIX}:done" # list: job_id (optional)
+DB_WRITES_KEY = f"{APP_PREFIX}:db_writes" # list: analysis row json (db_writer.py)
 
 
 # ----------------------------
@@ -30,13 +37,14 @@ DONE_KEY = f"{APP_PREFIX}:done" # list: job_id (optional)
 # ----------------------------
 _mem_jobs: Dict[str, Dict[str, Any]] = {}
 _mem_audio: Dict[str, Dict[str, Any]] = {}
-_mem_queue: list[str] = []
-_mem_done: list[str] = []
+_mem_queue: deque[str] = deque() # O(1) popleft under burst
+_mem_done: deque[str] = deque()
 _mem_rate: Dict[str, list[float]] = {} # key -> timestamps
+_mem_results: Dict[str, Tuple[float, Dict[str, Any]]] = {} # key -> (expires_at, result)
 
 
 # ----------------------------
-# Redis client (lazy)
+# Redis client (lazy, shared pool from redis_pool.py)
 # ----------------------------
 _redis = None
 
@@ -53,15 +61,8 @@ def _get_redis():
         return _redis
 
     try:
-        import redis # redis==5.x
-        _redis = redis.Redis.from_url(
-            REDIS_URL,
-            decode_responses=True, # store strings
-            socket_timeout=5,
-            socket_connect_timeout=5,
-            health_check_interval=30,
-        )
-        # quick ping to validate
+        _redis = get_client()
+        # quick ping to validate (also warms the first connection)
         _redis.ping()
         return _redis
     except Exception as e:
@@ -71,29 +72,85 @@ def _get_redis():
         return None
 
 
+# ----------------------------
+# Random ids (pooled urandom)
+# ----------------------------
+_RNG_POOL_SIZE = 4096
+_rng_pool = b""
+_rng_pos = 0
+_rng_lock = threading.Lock()
+
+def _rng_reset() -> None:
+    # forked children must not replay the parent's pool, and get a fresh
+    # lock (another thread may have held it at fork time)
+    global _rng_pool, _rng_pos, _rng_lock
+    _rng_pool, _rng_pos = b"", 0
+    _rng_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_rng_reset)
+
+def _rand_hex(n: int) -> str:
+    """
+    n random bytes as hex, sliced from a pooled os.urandom buffer:
+    one getrandom() per 4 KiB instead of one per id.
+    """
+    global _rng_pool, _rng_pos
+    with _rng_lock:
+        if _rng_pos + n > len(_rng_pool):
+            _rng_pool = os.urandom(_RNG_POOL_SIZE)
+            _rng_pos = 0
+        chunk = _rng_pool[_rng_pos:_rng_pos + n]
+        _rng_pos += n
+    return chunk.hex()
+
+
 # ============================================================
 # Rate limiting
 # ============================================================
 
+# Sliding-window limiter, atomic on the Redis side (one EVALSHA per check).
+# KEYS[1] = zset of request timestamps (ms)
+# ARGV = now_ms, window_ms, limit, member
+RL_LUA = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+if redis.call('ZCARD', key) >= tonumber(ARGV[3]) then
+  return 0
+end
+redis.call('ZADD', key, now, ARGV[4])
+redis.call('PEXPIRE', key, window)
+return 1
+"""
+
+_rl_script = None
+
 def rate_limit_allow(
     key: str,
     limit: int = RL_MAX_REQ,
     window_s: int = RL_WINDOW_S,
 ) -> bool:
     """
-    Simple fixed-window limiter:
-    - Redis: INCR + EXPIRE
+    Sliding-window limiter:
+    - Redis: one Lua script (ZREMRANGEBYSCORE + ZCARD + ZADD + PEXPIRE),
+      sent as EVALSHA and reloaded automatically on NOSCRIPT
     - Memory: timestamps list in window
     """
+    global _rl_script
     r = _get_redis()
-    bucket = f"{APP_PREFIX}:rl:{key}:{int(time.time() // window_s)}"
 
     if r:
         try:
-            val = r.incr(bucket)
-            if val == 1:
-                r.expire(bucket, window_s + 2)
-            return val <= limit
+            if _rl_script is None:
+                _rl_script = r.register_script(RL_LUA)
+            now_ms = int(time.time() * 1000)
+            allowed = _rl_script(
+                keys=[f"{APP_PREFIX}:rl:{key}"],
+                args=[now_ms, window_s * 1000, limit, f"{now_ms}-{_rand_hex(4)}"],
+                client=r,
+            )
+            return bool(int(allowed))
         except Exception as e:
             print(f"⚠️ Redis rate-limit failed, using memory. Reason: {e}")
 
@@ -113,11 +170,12 @@ def rate_limit_allow(
 # Job storage
 # ============================================================
 
-def _json_dumps(obj: Any) -> str:
-    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+def _json_dumps(obj: Any) -> bytes:
+    # compact UTF-8 bytes; redis-py sends them as-is
+    return orjson.dumps(obj)
 
-def _json_loads(s: str) -> Any:
-    return json.loads(s)
+def _json_loads(s: str | bytes) -> Any:
+    return orjson.loads(s)
 
 def set_job(job_id: str, data: Dict[str, Any]) -> None:
     """
@@ -207,17 +265,68 @@ def enqueue(job_id: str) -> None:
     _mem_queue.append(job_id)
 
 
+def enqueue_many(job_ids: list[str]) -> None:
+    """
+    Enqueue a batch of job ids with one variadic RPUSH (one round-trip
+    for the whole batch). Order is preserved.
+    """
+    if not job_ids:
+        return
+
+    r = _get_redis()
+    if r:
+        try:
+            r.rpush(QUEUE_KEY, *job_ids)
+            return
+        except Exception as e:
+            print(f"⚠️ Redis enqueue_many failed, using memory. Reason: {e}")
+
+    _mem_queue.extend(job_ids)
+
+
+def submit_job(
+    job_id: str,
+    data: Dict[str, Any],
+    audio_path: str,
+    extra: Optional[Dict[str, Any]] = None,
+) -> None:
+    """
+    set_audio + set_job + enqueue in one call.
+    - Redis: single pipelined round-trip instead of three
+    - Memory: same writes as the individual helpers
+    """
+    payload: Dict[str, Any] = {"path": audio_path}
+    if extra:
+        payload.update(extra)
+
+    r = _get_redis()
+    if r:
+        try:
+            pipe = r.pipeline(transaction=False)
+            pipe.hset(AUDIO_KEY, job_id, _json_dumps(payload))
+            pipe.hset(JOBS_KEY, job_id, _json_dumps(data))
+            pipe.rpush(QUEUE_KEY, job_id)
+            pipe.execute()
+            return
+        except Exception as e:
+            print(f"⚠️ Redis submit_job failed, using memory. Reason: {e}")
+
+    _mem_audio[job_id] = payload
+    _mem_jobs[job_id] = data
+    _mem_queue.append(job_id)
+
+
 def dequeue(block: bool = False, timeout_s: int = 10) -> Optional[str]:
     """
     Pop next job id (for worker).
-    - Redis: BLPOP (blocking) or LPOP
-    - Memory: pop(0)
+    - Redis: BLPOP on the blocking client (no socket timeout) or LPOP
+    - Memory: popleft(); sleeps timeout_s when blocking on an empty queue
     """
     r = _get_redis()
     if r:
         try:
             if block:
-                item = r.blpop(QUEUE_KEY, timeout=timeout_s)
+                item = get_blocking_client().blpop(QUEUE_KEY, timeout=timeout_s)
                 if not item:
                     return None
                 _, job_id = item
@@ -225,10 +334,40 @@ def dequeue(block: bool = False, timeout_s: int = 10) -> Optional[str]:
             return r.lpop(QUEUE_KEY)
         except Exception as e:
             print(f"⚠️ Redis dequeue failed, using memory. Reason: {e}")
+            # jobs may still sit in Redis: short back-off, not a full poll sleep
+            if not _mem_queue:
+                if block:
+                    time.sleep(1)
+                return None
 
     if not _mem_queue:
+        if block:
+            time.sleep(timeout_s) # behave like an empty BLPOP (no busy loop)
         return None
-    return _mem_queue.pop(0)
+    return _mem_queue.popleft()
+
+
+def finish_job(job_id: str, data: Dict[str, Any]) -> None:
+    """
+    Final write for a job: set_job + drop its audio record + mark_done.
+    - Redis: single pipelined round-trip instead of three
+    - Memory: same writes as the individual helpers
+    """
+    r = _get_redis()
+    if r:
+        try:
+            pipe = r.pipeline(transaction=False)
+            pipe.hset(JOBS_KEY, job_id, _json_dumps(data))
+            pipe.hdel(AUDIO_KEY, job_id)
+            pipe.rpush(DONE_KEY, job_id)
+            pipe.execute()
+            return
+        except Exception as e:
+            print(f"⚠️ Redis finish_job failed, using memory. Reason: {e}")
+
+    _mem_jobs[job_id] = data
+    _mem_audio.pop(job_id, None)
+    _mem_done.append(job_id)
 
 
 def mark_done(job_id: str) -> None:
@@ -246,12 +385,132 @@ def mark_done(job_id: str) -> None:
     _mem_done.append(job_id)
 
 
+# ============================================================
+# Result cache (content hash -> analysis result)
+# ============================================================
+
+def set_cached_result(key: str, result: Dict[str, Any], ttl_s: int = RESULT_TTL_S) -> None:
+    """
+    Cache an analysis result for ttl_s.
+    - Redis: SETEX {prefix}:result:{key}
+    - Memory: dict with expiry timestamp
+    """
+    r = _get_redis()
+    if r:
+        try:
+            r.setex(f"{APP_PREFIX}:result:{key}", ttl_s, _json_dumps(result))
+            return
+        except Exception as e:
+            print(f"⚠️ Redis set_cached_result failed, using memory. Reason: {e}")
+
+    _mem_results[key] = (time.time() + ttl_s, result)
+
+
+def get_cached_result(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Fetch a cached analysis result, or None on miss/expiry.
+    """
+    r = _get_redis()
+    if r:
+        try:
+            val = r.get(f"{APP_PREFIX}:result:{key}")
+            if not val:
+                return None
+            return _json_loads(val)
+        except Exception as e:
+            print(f"⚠️ Redis get_cached_result failed, using memory. Reason: {e}")
+
+    hit = _mem_results.get(key)
+    if not hit:
+        return None
+    if hit[0] < time.time():
+        _mem_results.pop(key, None)
+        return None
+    return hit[1]
+
+
+# ============================================================
+# DB write queue (worker -> db_writer.py)
+# ============================================================
+
+def push_db_write(row: Dict[str, Any]) -> bool:
+    """
+    Queue an analysis row for db_writer.py.
+    Returns False when Redis is unavailable: memory mode is not shared
+    across processes, so the caller should insert directly.
+    """
+    r = _get_redis()
+    if r:
+        try:
+            r.rpush(DB_WRITES_KEY, _json_dumps(row))
+            return True
+        except Exception as e:
+            print(f"⚠️ Redis push_db_write failed. Reason: {e}")
+    return False
+
+
+def pop_db_writes(count: int = 100, timeout_s: int = 10) -> list[Dict[str, Any]]:
+    """
+    Next batch of queued rows (up to count), blocking up to timeout_s
+    for the first one.
+    - Redis: BLPOP (blocking client) for the first row, then the rest
+      with LRANGE + LTRIM in one MULTI (atomic, any Redis version)
+    - Memory: nothing to consume, sleeps timeout_s and returns []
+    """
+    r = _get_redis()
+    if r:
+        try:
+            item = get_blocking_client().blpop(DB_WRITES_KEY, timeout=timeout_s)
+        except Exception as e:
+            print(f"⚠️ Redis pop_db_writes failed. Reason: {e}")
+            time.sleep(1) # short back-off, rows may still be queued
+            return []
+        if not item:
+            return []
+
+        vals = [item[1]]
+        if count > 1:
+            try:
+                pipe = r.pipeline(transaction=True)
+                pipe.lrange(DB_WRITES_KEY, 0, count - 2)
+                pipe.ltrim(DB_WRITES_KEY, count - 1, -1)
+                rest, _ = pipe.execute()
+                vals.extend(rest)
+            except Exception as e:
+                # nothing else was removed; hand back the row BLPOP already took
+                print(f"⚠️ Redis pop_db_writes batch read failed. Reason: {e}")
+        return [_json_loads(v) for v in vals]
+
+    time.sleep(timeout_s)
+    return []
+
+
+def requeue_db_writes(rows: list[Dict[str, Any]]) -> None:
+    """
+    Put unwritten rows back at the head of the queue (original order),
+    e.g. while Postgres is unreachable.
+    - Redis: one LPUSH (rows reversed, since LPUSH prepends one by one)
+    - Memory: nothing to requeue into
+    """
+    if not rows:
+        return
+
+    r = _get_redis()
+    if r:
+        try:
+            r.lpush(DB_WRITES_KEY, *[_json_dumps(row) for row in reversed(rows)])
+            return
+        except Exception as e:
+            print(f"⚠️ Redis requeue_db_writes failed. Reason: {e}")
+    print(f"⚠️ dropping {len(rows)} db rows (no Redis to requeue into)")
+
+
 # ============================================================
 # Helpers
 # ============================================================
 
 def new_job_id(prefix: str = "job") -> str:
-    return f"{prefix}_{uuid.uuid4().hex[:12]}"
+    return f"{prefix}_{_rand_hex(6)}"
 
 def health() -> Dict[str, Any]:
     """
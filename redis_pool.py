@@ -0,0 +1,67 @@
+# file: AI/redis_pool.py
+import os
+
+# ============================================================
+# VoiceSafe AI - Shared Redis pool
+# - one BlockingConnectionPool per process, used by every module
+# - bounded sockets: callers wait for a free connection instead of
+#   opening new ones past REDIS_POOL_SIZE
+# ============================================================
+
+# redis://host:port/db, rediss://... or unix:///path/redis.sock (colocated Redis)
+REDIS_URL = (os.getenv("REDIS_URL", "") or "").strip()
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", "32"))
+REDIS_POOL_TIMEOUT_S = int(os.getenv("REDIS_POOL_TIMEOUT_S", "5"))
+
+_client = None
+_blocking_client = None
+
+def get_client():
+    """
+    Returns the process-wide redis client, creating the pool on first use.
+    Returns None if REDIS_URL is not set; raises if redis is not installed.
+    """
+    global _client
+    if not REDIS_URL:
+        return None
+
+    if _client is None:
+        import redis # redis==5.x
+        pool = redis.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=REDIS_POOL_SIZE,
+            timeout=REDIS_POOL_TIMEOUT_S,
+            decode_responses=True, # store strings
+            socket_timeout=5,
+            socket_connect_timeout=5,
+            health_check_interval=30,
+        )
+        _client = redis.Redis(connection_pool=pool)
+    return _client
+
+
+def get_blocking_client():
+    """
+    Client for BLPOP-style calls (worker / db_writer polls).
+    Separate small pool with no socket read timeout: redis-py does not
+    extend socket_timeout for blocking commands, so a 30 s BLPOP on the
+    shared client would be cut off after 5 s (and could drop a popped item).
+    """
+    global _blocking_client
+    if not REDIS_URL:
+        return None
+
+    if _blocking_client is None:
+        import redis # redis==5.x
+        pool = redis.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=4,
+            timeout=REDIS_POOL_TIMEOUT_S,
+            decode_responses=True,
+            socket_timeout=None, # the BLPOP timeout bounds the wait
+            socket_connect_timeout=5,
+            socket_keepalive=True,
+            health_check_interval=30,
+        )
+        _blocking_client = redis.Redis(connection_pool=pool)
+    return _blocking_client
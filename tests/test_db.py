@@ -0,0 +1,29 @@
+# file: AI/tests/test_db.py
+# run: python -m pytest -q (from the repo root; no database needed)
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+import db
+
+
+ROW_KEYS = {
+    "id", "ip", "filename", "bytes", "scam_score", "ai_voice_prob",
+    "stress_level", "summary", "flags", "meta",
+}
+
+
+def _compiled():
+    return text(db.INSERT_SQL).compile(dialect=postgresql.dialect())
+
+
+def test_insert_binds_every_row_column():
+    # ":x::jsonb" is not parsed as a bind param by text(); every column
+    # the worker sends must be one
+    assert set(_compiled().params) == ROW_KEYS
+
+
+def test_insert_sql_has_no_literal_placeholders():
+    sql = str(_compiled())
+    assert ":flags" not in sql and ":meta" not in sql
+    assert "CAST(%(flags)s AS jsonb)" in sql
+    assert "CAST(%(meta)s AS jsonb)" in sql
@@ -0,0 +1,32 @@
+# file: AI/tests/test_db_writer.py
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import db_writer
+
+
+ROWS = [{"id": f"job_{i}"} for i in range(3)]
+
+
+def test_bad_row_loses_only_itself(monkeypatch):
+    written = []
+
+    def insert_analyses(rows):
+        raise IntegrityError("INSERT", {}, Exception("duplicate key"))
+
+    def insert_analysis(row):
+        if row["id"] == "job_1":
+            raise IntegrityError("INSERT", {}, Exception("duplicate key"))
+        written.append(row["id"])
+
+    monkeypatch.setattr(db_writer, "insert_analyses", insert_analyses)
+    monkeypatch.setattr(db_writer, "insert_analysis", insert_analysis)
+    assert db_writer._write_batch(ROWS) == []
+    assert written == ["job_0", "job_2"]
+
+
+def test_db_outage_keeps_rows(monkeypatch):
+    def down(*_):
+        raise OperationalError("INSERT", {}, Exception("connection refused"))
+
+    monkeypatch.setattr(db_writer, "insert_analyses", down)
+    assert db_writer._write_batch(ROWS) == ROWS
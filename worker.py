@@ -1,25 +1,38 @@
 # file: AI/worker.py
-import json
+import atexit
+import hashlib
 import os
 import time
 import shutil
 import tempfile
 import math
+import mmap
 import subprocess
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
-from typing import Any, Dict, List, Tuple
+from queue import SimpleQueue
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
 
+import av
 import numpy as np
 import librosa
+import orjson
+import soundfile as sf
+import soxr
 
-from queue import (
-    dequeue_block,
+from job_queue import (
+    dequeue,
+    finish_job,
     get_audio,
-    del_audio,
+    get_cached_result,
     get_job,
+    push_db_write,
+    set_cached_result,
     set_job,
 )
-from db import db_init, insert_analysis
+from db import db_enabled, db_init, insert_analysis
 
 
 APP_NAME = "voicesafe-ai-worker"
@@ -28,8 +41,23 @@ VERSION = os.environ.get("APP_VERSION", "4.0.0-async")
 TARGET_SR = int(os.environ.get("TARGET_SR", "16000"))
 MAX_DURATION_S = float(os.environ.get("MAX_DURATION_S", "120"))
 MIN_DURATION_S = float(os.environ.get("MIN_DURATION_S", "0.6"))
+# every loader resamples to TARGET_SR, so the trim length is fixed too
+MAX_SAMPLES = int(MAX_DURATION_S * TARGET_SR)
 
 POLL_TIMEOUT_S = int(os.environ.get("WORKER_BLPOP_TIMEOUT_S", "30"))
+# analyze_audio processes (match the instance's vCPU count)
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", "2"))
+
+# per-worker scratch dir, set in each pool process by _init_process
+_work_dir: Optional[str] = None
+
+# STFT shared by the spectral features (librosa's defaults)
+N_FFT = 2048
+HOP_LENGTH = 512
+
+# pitch is tracked on a downsampled copy (fmax=400 Hz needs far less than 16 kHz)
+PITCH_SR = 8000
+PITCH_FRAME = 1024 # same 128 ms window as yin's default 2048 @ 16 kHz
 
 
 def _clamp(x, a=0.0, b=100.0) -> float:
@@ -41,7 +69,10 @@ def _clamp(x, a=0.0, b=100.0) -> float:
 
 
 def _finite(x: Any) -> np.ndarray:
-    arr = np.asarray(x, dtype=np.float64)
+    # features are float32 already; only compact when something is non-finite
+    arr = np.asarray(x, dtype=np.float32)
+    if np.isfinite(arr).all():
+        return arr
     return arr[np.isfinite(arr)]
 
 
@@ -92,66 +123,144 @@ class LoadInfo:
     loader: str
 
 
-def _load_audio_any(path: str) -> Tuple[np.ndarray, LoadInfo]:
-    try:
-        y, sr = librosa.load(path, sr=TARGET_SR, mono=True)
-        dur = float(librosa.get_duration(y=y, sr=sr))
-        if not np.isfinite(dur) or dur <= 0 or y.size == 0:
-            raise RuntimeError("invalid_audio")
-        return y, LoadInfo(int(sr), dur, "librosa")
-    except Exception:
-        pass
+def _read_soundfile(src: Union[str, BinaryIO, mmap.mmap]) -> np.ndarray:
+    """
+    In-process decode via libsndfile (no audioread/ffmpeg fork),
+    downmixed to mono and resampled to TARGET_SR with soxr.
+    src is a path or any seekable file-like (e.g. an mmap).
+    """
+    y, sr = sf.read(src, dtype="float32", always_2d=False)
+    if y.ndim > 1:
+        y = y.mean(axis=1)
+    if sr != TARGET_SR:
+        y = soxr.resample(y, sr, TARGET_SR)
+    return y
+
+
+def _read_av(path: str) -> np.ndarray:
+    """
+    In-process decode via PyAV (libavformat/libavcodec, no ffmpeg fork),
+    resampled to mono float32 at TARGET_SR while decoding.
+    """
+    chunks: List[np.ndarray] = []
+    with av.open(path) as container:
+        stream = container.streams.audio[0]
+        resampler = av.AudioResampler(format="flt", layout="mono", rate=TARGET_SR)
+        for frame in container.decode(stream):
+            for rf in resampler.resample(frame):
+                chunks.append(rf.to_ndarray().reshape(-1))
+        for rf in resampler.resample(None): # flush buffered samples
+            chunks.append(rf.to_ndarray().reshape(-1))
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(chunks)
+
+
+# containers libsndfile decodes natively; everything else goes straight to PyAV
+_SNDFILE_KINDS = frozenset({"wav", "flac", "ogg"})
+
+
+def _sniff(head: bytes) -> str:
+    """
+    Container type from the first 12 bytes (magic numbers).
+    """
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[:4] == b"fLaC":
+        return "flac"
+    if head[:4] == b"OggS":
+        return "ogg"
+    if head[:3] == b"ID3" or (len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0):
+        return "mpeg" # mp3 / adts frame sync
+    return "other"
 
-    with tempfile.TemporaryDirectory() as td:
-        wav_path = os.path.join(td, "converted.wav")
-        _ffmpeg_to_wav(path, wav_path)
-        y, sr = librosa.load(wav_path, sr=TARGET_SR, mono=True)
-        dur = float(librosa.get_duration(y=y, sr=sr))
-        if not np.isfinite(dur) or dur <= 0 or y.size == 0:
-            raise RuntimeError("invalid_audio_after_ffmpeg")
-        return y, LoadInfo(int(sr), dur, "ffmpeg->librosa")
 
-
-def _normalize_and_trim(y: np.ndarray, sr: int) -> np.ndarray:
-    y = y.astype(np.float32, copy=False)
-    max_n = int(MAX_DURATION_S * sr)
-    if max_n > 0 and y.size > max_n:
-        y = y[:max_n]
-    y = y - float(np.mean(y))
-    peak = float(np.max(np.abs(y)) + 1e-9)
-    return y / peak
+def _load_audio_any(path: str) -> Tuple[np.ndarray, LoadInfo]:
+    if os.path.getsize(path) == 0:
+        raise RuntimeError("empty_audio")
+
+    # sniff + libsndfile decode straight from the mapping (pages fault in
+    # lazily, no read() chain); PyAV opens the path itself
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if _sniff(mm[:12]) in _SNDFILE_KINDS:
+            loaders = (("soundfile", _read_soundfile, mm), ("pyav", _read_av, path))
+        else:
+            loaders = (("pyav", _read_av, path),)
+
+        for name, read, src in loaders:
+            try:
+                y = read(src)
+            except Exception:
+                continue
+            if y.size:
+                return y, LoadInfo(TARGET_SR, y.size / TARGET_SR, name)
+
+    # last resort: ffmpeg CLI -> WAV, overwritten in place in the worker's
+    # scratch dir (no mkdtemp/rmtree per job); ad-hoc callers get a temp dir
+    if _work_dir is None:
+        with tempfile.TemporaryDirectory() as td:
+            return _load_via_ffmpeg(path, os.path.join(td, "converted.wav"))
+    return _load_via_ffmpeg(path, os.path.join(_work_dir, f"converted-{os.getpid()}.wav"))
+
+
+def _load_via_ffmpeg(path: str, wav_path: str) -> Tuple[np.ndarray, LoadInfo]:
+    _ffmpeg_to_wav(path, wav_path)
+    y = _read_soundfile(wav_path)
+    dur = y.size / TARGET_SR
+    if dur <= 0:
+        raise RuntimeError("invalid_audio_after_ffmpeg")
+    return y, LoadInfo(TARGET_SR, dur, "ffmpeg->soundfile")
+
+
+def _normalize_and_trim(y: np.ndarray) -> np.ndarray:
+    if MAX_SAMPLES > 0 and y.size > MAX_SAMPLES:
+        y = y[:MAX_SAMPLES]
+    # one contiguous float32 copy, then normalize in place (SIMD-friendly
+    # reductions downstream, no float64 upcast, no extra temporaries)
+    y = np.array(y, dtype=np.float32, order="C")
+    y -= np.mean(y, dtype=np.float32)
+    y /= np.max(np.abs(y)) + np.float32(1e-9)
+    return y
 
 
 def analyze_audio(path: str) -> Dict[str, Any]:
     y, info = _load_audio_any(path)
     if info.duration_s < MIN_DURATION_S:
         raise RuntimeError("too_short_audio")
+    return _analyze_signal(y, info)
+
 
-    y = _normalize_and_trim(y, info.sr)
+def _analyze_signal(y: np.ndarray, info: LoadInfo) -> Dict[str, Any]:
+    y = _normalize_and_trim(y)
 
-    rms = _safe_mean(librosa.feature.rms(y=y))
+    # rms frames are computed once and reused for mean + variability
+    rms_frames = librosa.feature.rms(y=y).ravel()
+    rms = _safe_mean(rms_frames)
+    rms_var = _safe_std(rms_frames)
     zcr = _safe_mean(librosa.feature.zero_crossing_rate(y))
-    centroid = _safe_mean(librosa.feature.spectral_centroid(y=y, sr=info.sr))
-    flatness = _safe_mean(librosa.feature.spectral_flatness(y=y))
-    rolloff = _safe_mean(librosa.feature.spectral_rolloff(y=y, sr=info.sr, roll_percent=0.85))
 
-    mfcc = librosa.feature.mfcc(y=y, sr=info.sr, n_mfcc=13)
+    # one magnitude spectrogram instead of an STFT per feature (incl. MFCC)
+    S = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+    centroid = _safe_mean(librosa.feature.spectral_centroid(S=S, sr=info.sr))
+    flatness = _safe_mean(librosa.feature.spectral_flatness(S=S))
+    rolloff = _safe_mean(librosa.feature.spectral_rolloff(S=S, sr=info.sr, roll_percent=0.85))
+
+    # same mel (128 bands) / dB / DCT chain mfcc(y=...) runs, minus its own STFT
+    mel = librosa.feature.melspectrogram(S=np.square(S), sr=info.sr)
+    mfcc = librosa.feature.mfcc(S=librosa.power_to_db(mel), n_mfcc=13)
     mfcc_std = _safe_mean(np.std(mfcc, axis=1))
 
-    f0 = librosa.yin(y, fmin=70, fmax=400, sr=info.sr)
-    f0 = _finite(f0)
-    f0 = f0[(f0 > 50) & (f0 < 500)]
-    f0_mean = _safe_mean(f0)
-    f0_std = _safe_std(f0)
+    # yin already bounds f0 to [fmin, fmax]; only non-finite frames need dropping
+    y_pitch = soxr.resample(y, info.sr, PITCH_SR)
+    f0 = _finite(librosa.yin(y_pitch, fmin=70, fmax=400, sr=PITCH_SR, frame_length=PITCH_FRAME))
+    f0_mean = float(np.mean(f0)) if f0.size else 0.0
+    f0_std = float(np.std(f0)) if f0.size else 0.0
 
     if f0.size >= 4 and f0_mean > 1e-6:
         jitter = float(np.median(np.abs(np.diff(f0))) / f0_mean)
     else:
         jitter = 0.0
 
-    rms_frames = librosa.feature.rms(y=y).flatten()
-    rms_var = _safe_std(rms_frames)
-
     s_smooth = 1.0 - _clamp(jitter * 220.0, 0, 100) / 100.0
     s_mfcc = 1.0 - _clamp(mfcc_std * 18.0, 0, 100) / 100.0
     s_f0std = 1.0 - _clamp(f0_std * 0.45, 0, 100) / 100.0
@@ -198,25 +307,194 @@ def analyze_audio(path: str) -> Dict[str, Any]:
         "voice_match": "Unknown",
         "meta": {
             "version": VERSION,
-            "duration_s": round(float(info.duration_s), 3),
-            "sr": int(info.sr),
+            "duration_s": round(info.duration_s, 3),
+            "sr": info.sr,
             "loader": info.loader,
         },
     }
 
 
-def _job_update(job_id: str, patch: Dict[str, Any]) -> None:
-    raw = get_job(job_id)
-    if raw:
+def _job_update(job_id: str, job: Dict[str, Any], patch: Dict[str, Any]) -> None:
+    # job is loaded once per job and kept in memory; each update is one write
+    job.update(patch)
+    set_job(job_id, job)
+
+
+def _job_finish(job_id: str, job: Dict[str, Any], patch: Dict[str, Any]) -> None:
+    # final status + audio record cleanup + done list, one Redis round-trip
+    job.update(patch)
+    finish_job(job_id, job)
+
+
+def _warmup() -> None:
+    """
+    Run the feature pipeline once on a synthetic 1 s tone so librosa's
+    lazily-compiled numba kernels (yin, mel/DCT, ...) are built before
+    the first real job instead of during it.
+    """
+    t = np.arange(TARGET_SR, dtype=np.float32) / TARGET_SR
+    y = 0.5 * np.sin(2.0 * np.pi * 220.0 * t, dtype=np.float32)
+    try:
+        _analyze_signal(y, LoadInfo(TARGET_SR, 1.0, "warmup"))
+    except Exception as e:
+        print(f"[worker] warmup failed: {e}")
+
+
+@dataclass
+class RunningJob:
+    job_id: str
+    job: Dict[str, Any]
+    file_path: str
+    size: int
+    t0: float
+    content_key: str
+
+
+def _content_key(path: str) -> str:
+    """
+    Result-cache key: worker version + blake2b of the upload bytes
+    (stdlib, faster than sha256 without SHA-NI; hashed in C off the GIL).
+    """
+    with open(path, "rb") as fh:
+        digest = hashlib.file_digest(fh, lambda: hashlib.blake2b(digest_size=16))
+    return f"{VERSION}:{digest.hexdigest()}"
+
+
+def _start_job(job_id: str) -> Optional[RunningJob]:
+    t0 = time.time()
+    job = get_job(job_id) or {"id": job_id}
+    _job_update(job_id, job, {"status": "processing", "started_at": int(time.time())})
+
+    # the API saved the upload on shared disk; only its path travels through Redis
+    audio = get_audio(job_id)
+    file_path = (audio or {}).get("path")
+    if not file_path or not os.path.isfile(file_path):
+        _job_finish(job_id, job, {"status": "failed", "error": "audio_missing_or_expired"})
+        return None
+
+    try:
+        size = os.path.getsize(file_path)
+        content_key = _content_key(file_path)
+    except OSError as e:
+        _job_finish(job_id, job, {"status": "failed", "error": f"audio_unreadable: {str(e)[:160]}"})
         try:
-            obj = json.loads(raw.decode("utf-8"))
-        except Exception:
-            obj = {"id": job_id}
-    else:
-        obj = {"id": job_id}
+            os.unlink(file_path)
+        except OSError:
+            pass
+        return None
+
+    run = RunningJob(job_id, job, file_path, size, t0, content_key)
+
+    # same bytes already analyzed (UI retries, abuse probes): skip analyze_audio,
+    # but still record the job like any other
+    cached = get_cached_result(content_key)
+    if cached is not None:
+        _complete_job(run, None, cached)
+        return None
+    return run
 
-    obj.update(patch)
-    set_job(job_id, json.dumps(obj).encode("utf-8"))
+
+def _analysis_row(run: RunningJob, result: Dict[str, Any]) -> Dict[str, Any]:
+    job = run.job
+    return {
+        "id": run.job_id,
+        "ip": job.get("ip") or None,
+        "filename": job.get("filename") or None,
+        "bytes": run.size,
+        "scam_score": float(result.get("scam_score", 0.0)),
+        "ai_voice_prob": float(result.get("ai_voice_prob", 0.0)),
+        "stress_level": float(result.get("stress_level", 0.0)),
+        "summary": str(result.get("summary", ""))[:2000],
+        # jsonb params are bound as text, so decode orjson's bytes
+        "flags": orjson.dumps(result.get("flags", [])).decode(),
+        "meta": orjson.dumps(result.get("meta", {})).decode(),
+    }
+
+
+def _complete_job(
+    run: RunningJob,
+    fut: Optional[Future],
+    cached: Optional[Dict[str, Any]] = None,
+) -> None:
+    job_id, job = run.job_id, run.job
+    try:
+        if cached is None:
+            result = fut.result()
+            set_cached_result(run.content_key, result)
+        else:
+            result = cached
+
+        # Persist to DB (optional): queued for db_writer.py so Postgres
+        # latency stays off the job; inline insert only without Redis.
+        # Nothing is queued without DATABASE_URL (no one would drain it).
+        if db_enabled():
+            row = _analysis_row(run, result)
+            if not push_db_write(row):
+                try:
+                    insert_analysis(row)
+                except Exception:
+                    pass
+
+        patch = {
+            "status": "done",
+            "finished_at": int(time.time()),
+            "result": result,
+            "ms": round((time.time() - run.t0) * 1000.0, 2),
+        }
+        if cached is not None:
+            patch["cached"] = True
+        _job_finish(job_id, job, patch)
+
+    except Exception as e:
+        _job_finish(job_id, job, {"status": "failed", "error": str(e)[:200]})
+    finally:
+        # cleanup: the upload is ours once dequeued
+        try:
+            os.unlink(run.file_path)
+        except OSError:
+            pass
+
+
+def _init_process(work_dir: str) -> None:
+    global _work_dir
+    _work_dir = work_dir
+    # each process warms its own numba kernels before taking jobs
+    _warmup()
+
+
+def _ready() -> int:
+    time.sleep(0.05) # long enough that each pool process picks up one
+    return os.getpid()
+
+
+def _new_pool(work_dir: str) -> ProcessPoolExecutor:
+    pool = ProcessPoolExecutor(
+        max_workers=WORKER_CONCURRENCY,
+        initializer=_init_process,
+        initargs=(work_dir,),
+    )
+    # processes start lazily on submit: start and warm all of them now so
+    # the warmup never lands on a job's clock
+    pids: set = set()
+    for _ in range(50):
+        futs = [pool.submit(_ready) for _ in range(WORKER_CONCURRENCY)]
+        pids.update(f.result() for f in futs)
+        if len(pids) >= WORKER_CONCURRENCY:
+            break
+    return pool
+
+
+def _feed(events: SimpleQueue, slots: threading.Semaphore) -> None:
+    """
+    Dequeue thread: takes one job id per free pool slot and hands it to
+    the main loop, so a blocking BLPOP never delays recording a finished job.
+    """
+    while True:
+        slots.acquire()
+        job_id = None
+        while not job_id:
+            job_id = dequeue(block=True, timeout_s=POLL_TIMEOUT_S)
+        events.put(("job", job_id))
 
 
 def main():
@@ -226,61 +504,44 @@ def main():
     except Exception:
         pass
 
-    print(f"[worker] started {APP_NAME} version={VERSION}")
+    # one scratch dir for the worker's lifetime, shared by the pool processes
+    work_dir = tempfile.mkdtemp(prefix="voicesafe_worker_")
+    atexit.register(shutil.rmtree, work_dir, ignore_errors=True)
 
-    while True:
-        job_id = dequeue_block(timeout_s=POLL_TIMEOUT_S)
-        if not job_id:
-            continue
-
-        t0 = time.time()
-        _job_update(job_id, {"status": "processing", "started_at": int(time.time())})
-
-        audio = get_audio(job_id)
-        if not audio:
-            _job_update(job_id, {"status": "failed", "error": "audio_missing_or_expired"})
-            continue
-
-        tmp_dir = tempfile.mkdtemp(prefix="voicesafe_worker_")
-        file_path = os.path.join(tmp_dir, "input.bin")
+    # Redis / DB bookkeeping stays in this process; only analyze_audio
+    # runs in the pool, so N jobs use N cores instead of sharing one GIL.
+    pool = _new_pool(work_dir)
+    running: Dict[Future, RunningJob] = {}
 
-        try:
-            with open(file_path, "wb") as f:
-                f.write(audio)
+    print(f"[worker] started {APP_NAME} version={VERSION} concurrency={WORKER_CONCURRENCY}")
 
-            result = analyze_audio(file_path)
+    # one event stream: new job ids from _feed, finished futures from callbacks
+    events: SimpleQueue = SimpleQueue()
+    slots = threading.Semaphore(WORKER_CONCURRENCY)
+    threading.Thread(target=_feed, args=(events, slots), name="dequeue", daemon=True).start()
 
-            # Persist to DB (optional)
-            try:
-                insert_analysis({
-                    "id": job_id,
-                    "ip": (get_job(job_id) and json.loads(get_job(job_id).decode("utf-8")).get("ip")) or None,
-                    "filename": (get_job(job_id) and json.loads(get_job(job_id).decode("utf-8")).get("filename")) or None,
-                    "bytes": len(audio),
-                    "scam_score": float(result.get("scam_score", 0.0)),
-                    "ai_voice_prob": float(result.get("ai_voice_prob", 0.0)),
-                    "stress_level": float(result.get("stress_level", 0.0)),
-                    "summary": str(result.get("summary", ""))[:2000],
-                    "flags": json.dumps(result.get("flags", [])),
-                    "meta": json.dumps(result.get("meta", {})),
-                })
-            except Exception:
-                pass
+    while True:
+        kind, item = events.get()
 
-            _job_update(job_id, {
-                "status": "done",
-                "finished_at": int(time.time()),
-                "result": result,
-                "ms": round((time.time() - t0) * 1000.0, 2),
-            })
+        if kind == "done":
+            _complete_job(running.pop(item), item)
+            slots.release()
+            continue
 
-        except Exception as e:
-            _job_update(job_id, {"status": "failed", "error": str(e)[:200]})
-        finally:
-            # cleanup
-            del_audio(job_id) # free Redis memory
-            shutil.rmtree(tmp_dir, ignore_errors=True)
+        run = _start_job(item)
+        if not run:
+            slots.release()
+            continue
+        try:
+            fut = pool.submit(analyze_audio, run.file_path)
+        except BrokenProcessPool:
+            # a child died (e.g. OOM): its in-flight jobs fail via their
+            # futures; continue on a fresh pool
+            pool = _new_pool(work_dir)
+            fut = pool.submit(analyze_audio, run.file_path)
+        running[fut] = run
+        fut.add_done_callback(lambda f: events.put(("done", f)))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()